@@ -1,41 +1,86 @@
 import asyncio
 import json
+import logging
 import os
-from functools import lru_cache
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 import aiohttp
-from aiogram import Bot, Dispatcher, F, types
+import orjson
+import redis.asyncio as aioredis
+from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from dotenv import load_dotenv
-from sqlalchemy import Column, Integer, String, select
+from sqlalchemy import Column, Integer, String, bindparam, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 TOKEN = os.getenv("TOKEN")
 DATABASE_URI = os.getenv("DATABASE")
 API_KEY = os.getenv("API_KEY")
+REDIS_URL = os.getenv("REDIS_URL")
 NEWSAPI_URL = "https://newsapi.org/v2/everything"
+NEWS_CACHE_TTL = 120
+NEWS_CACHE_MAX_SIZE = 256
+USER_CITY_CACHE_TTL = 300
+USER_CITY_CACHE_MAX_SIZE = 1024
+DB_POOL_SIZE = 10
+NEWS_REFRESH_INTERVAL = int(os.getenv("NEWS_REFRESH_INTERVAL", 900))
+NEWS_REFRESH_QUERIES = [
+    query.strip()
+    for query in os.getenv("NEWS_REFRESH_QUERIES", "Україна").split(",")
+    if query.strip()
+]
+NEWS_REFRESH_PAGE_SIZE = 20
+NEWS_REDIS_TTL = NEWS_REFRESH_INTERVAL + 30
+ARTICLE_TEMPLATE = "📰 <b>{}</b>\n{}"
 
 with open("popular_cities.json", "r", encoding="utf-8") as f:
-    POPULAR_CITIES = set(city.title() for city in json.load(f)["popular_cities"])
+    POPULAR_CITIES = frozenset(city.title() for city in json.load(f)["popular_cities"])
 
-bot = Bot(token=TOKEN)
+bot_session = AiohttpSession(limit=100)
+bot_session._connector_init.update(
+    limit_per_host=50, keepalive_timeout=75, ttl_dns_cache=300
+)
+bot = Bot(token=TOKEN, session=bot_session)
 dp = Dispatcher()
 
+HTTP_SESSION: aiohttp.ClientSession | None = None
+REDIS = (
+    aioredis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    if REDIS_URL
+    else None
+)
+_news_cache: dict[tuple[str, int], tuple[float, list]] = {}
+_inflight: dict[tuple[str, int], asyncio.Future] = {}
+USER_CITY_CACHE: dict[int, tuple[float, str | None]] = {}
+
 engine = create_async_engine(
     DATABASE_URI,
     echo=False,
     pool_pre_ping=True,
-    pool_size=10,
+    pool_size=DB_POOL_SIZE,
     max_overflow=20,
-    connect_args={"timeout": 10, "command_timeout": 10},
+    query_cache_size=1200,
+    connect_args={
+        "timeout": 10,
+        "command_timeout": 10,
+        "prepared_statement_cache_size": 200,
+        "statement_cache_size": 200,
+    },
 )
 
+autocommit_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+
 AsyncSessionLocal = sessionmaker(
     engine,
     class_=AsyncSession,
@@ -60,10 +105,17 @@ class Info(Base):
     __tablename__ = "info"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, unique=True, nullable=False)
+    user_id = Column(Integer, unique=True, nullable=False, index=True)
     city = Column(String, nullable=False)
 
 
+_CITY_STMT = (
+    select(Info.__table__.c.city)
+    .where(Info.__table__.c.user_id == bindparam("uid"))
+    .limit(1)
+)
+
+
 class CityState(StatesGroup):
     set_main_city = State()
     news_city = State()
@@ -73,39 +125,65 @@ class NewsState(StatesGroup):
     option = State()
 
 
+async def warm_connection():
+    async with engine.connect() as conn:
+        await conn.execute(select(1))
+
+
 async def init_models():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await asyncio.gather(*(warm_connection() for _ in range(DB_POOL_SIZE)))
 
 
-@lru_cache(maxsize=128)
 def valid_city(city: str):
     return city in POPULAR_CITIES
 
 
 async def create_or_update_city(session: AsyncSession, user_id: int, city: str):
     try:
-        result = await session.execute(
-            select(Info).where(Info.user_id == user_id).limit(1)
+        stmt = (
+            pg_insert(Info)
+            .values(user_id=user_id, city=city)
+            .on_conflict_do_update(index_elements=[Info.user_id], set_=dict(city=city))
         )
-        info = result.scalar_one_or_none()
-
-        if info:
-            info.city = city
-            await session.commit()
-            return info
-
-        new_info = Info(user_id=user_id, city=city)
-        session.add(new_info)
+        await session.execute(stmt)
         await session.commit()
-        return new_info
     except Exception as e:
         await session.rollback()
-        print(f"Помилка бази даних: {e}")
+        log.warning("Помилка бази даних: %s", e)
         raise
 
 
-async def fetch_news(query: str, page_size: int = 5):
+def cache_user_city(user_id: int, city: str | None):
+    USER_CITY_CACHE.pop(user_id, None)
+    if len(USER_CITY_CACHE) >= USER_CITY_CACHE_MAX_SIZE:
+        USER_CITY_CACHE.pop(next(iter(USER_CITY_CACHE)))
+    USER_CITY_CACHE[user_id] = (
+        asyncio.get_running_loop().time() + USER_CITY_CACHE_TTL,
+        city,
+    )
+
+
+async def get_user_city(user_id: int):
+    loop = asyncio.get_running_loop()
+    entry = USER_CITY_CACHE.get(user_id)
+    if entry and entry[0] > loop.time():
+        return entry[1]
+
+    try:
+        async with autocommit_engine.connect() as conn:
+            result = await conn.execute(_CITY_STMT, {"uid": user_id})
+            user_city = result.scalar()
+    except Exception as e:
+        log.warning("Помилка при читанні міста: %s", e)
+        return None
+
+    cache_user_city(user_id, user_city)
+    return user_city
+
+
+async def request_news(query: str, page_size: int):
     params = {
         "q": query,
         "language": "uk",
@@ -114,18 +192,88 @@ async def fetch_news(query: str, page_size: int = 5):
         "pageSize": page_size,
     }
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                NEWSAPI_URL, params=params, timeout=aiohttp.ClientTimeout(total=10)
-            ) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    return data.get("articles", [])
-                else:
-                    return []
+        async with HTTP_SESSION.get(NEWSAPI_URL, params=params) as resp:
+            if resp.status == 200:
+                data = await resp.json(loads=orjson.loads)
+                return data.get("articles", [])
+            else:
+                return None
     except Exception as e:
-        print(f"Помилка при запиті новин: {e}")
-        return []
+        log.warning("Помилка при запиті новин: %s", e)
+        return None
+
+
+def cache_news(key: tuple[str, int], articles: list):
+    _news_cache.pop(key, None)
+    if len(_news_cache) >= NEWS_CACHE_MAX_SIZE:
+        _news_cache.pop(next(iter(_news_cache)))
+    _news_cache[key] = (
+        asyncio.get_running_loop().time() + NEWS_CACHE_TTL,
+        articles,
+    )
+
+
+async def fetch_news(query: str, page_size: int = 5):
+    loop = asyncio.get_running_loop()
+    key = (query, page_size)
+    entry = _news_cache.get(key)
+    if entry and entry[0] > loop.time():
+        return entry[1]
+
+    if REDIS:
+        try:
+            raw = await REDIS.get(f"news:{query}")
+            if raw:
+                articles = orjson.loads(raw)[:page_size]
+                cache_news(key, articles)
+                return articles
+        except Exception as e:
+            log.warning("Помилка при читанні новин з Redis: %s", e)
+
+    fut = _inflight.get(key)
+    if fut:
+        return await asyncio.shield(fut)
+
+    fut = loop.create_future()
+    _inflight[key] = fut
+    try:
+        articles = await request_news(query, page_size)
+        if articles is None:
+            articles = []
+        else:
+            cache_news(key, articles)
+        fut.set_result(articles)
+        return articles
+    finally:
+        if not fut.done():
+            fut.set_result([])
+        _inflight.pop(key, None)
+
+
+async def refresh_news():
+    while True:
+        for query in NEWS_REFRESH_QUERIES:
+            articles = await request_news(query, NEWS_REFRESH_PAGE_SIZE)
+            if not articles:
+                continue
+            try:
+                await REDIS.set(
+                    f"news:{query}", orjson.dumps(articles), ex=NEWS_REDIS_TTL
+                )
+            except Exception as e:
+                log.warning("Помилка при збереженні новин у Redis: %s", e)
+        await asyncio.sleep(NEWS_REFRESH_INTERVAL)
+
+
+async def send_articles(message: types.Message, articles: list):
+    texts = [ARTICLE_TEMPLATE.format(a["title"], a["url"]) for a in articles]
+    results = await asyncio.gather(
+        *(message.answer(text, parse_mode="HTML") for text in texts),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            log.warning("Помилка при відправці новини: %s", result)
 
 
 @dp.message(CommandStart())
@@ -137,7 +285,6 @@ async def start_handler(message: types.Message):
 
 
 @dp.message(Command("choosecity"))
-@dp.message(F.text.lower() == "вибрати основне місто")
 async def choose_city_start(message: types.Message, state: FSMContext):
     await state.set_state(CityState.set_main_city)
     await message.answer(
@@ -145,6 +292,19 @@ async def choose_city_start(message: types.Message, state: FSMContext):
     )
 
 
+_ROUTES = {}
+
+
+def button_route(message: types.Message):
+    route = _ROUTES.get((message.text or "").lower().strip())
+    return {"route": route} if route else False
+
+
+@dp.message(button_route)
+async def route_text(message: types.Message, state: FSMContext, route):
+    return await route(message, state)
+
+
 # Встановлення основного міста
 @dp.message(CityState.set_main_city)
 async def set_main_city(message: types.Message, state: FSMContext):
@@ -156,6 +316,7 @@ async def set_main_city(message: types.Message, state: FSMContext):
     try:
         async with AsyncSessionLocal() as session:
             await create_or_update_city(session, message.from_user.id, city)
+        cache_user_city(message.from_user.id, city)
         await message.answer(
             f"Місто '{city}' успішно встановлено!", reply_markup=main_kb
         )
@@ -168,19 +329,11 @@ async def set_main_city(message: types.Message, state: FSMContext):
 
 
 @dp.message(Command("news"))
-@dp.message(F.text.lower() == "новини")
 async def news_start(message: types.Message, state: FSMContext):
     await state.set_state(NewsState.option)
 
-    user_city = None
-    try:
-        async with AsyncSessionLocal() as session:
-            result = await session.execute(
-                select(Info.city).where(Info.user_id == message.from_user.id).limit(1)
-            )
-            user_city = result.scalar_one_or_none()
-    except Exception as e:
-        print(f"Помилка при читанні міста: {e}")
+    user_city = await get_user_city(message.from_user.id)
+    await state.update_data(user_city=user_city)
 
     buttons = []
     if user_city:
@@ -197,19 +350,22 @@ async def news_start(message: types.Message, state: FSMContext):
     await message.answer("Виберіть опцію для новин:", reply_markup=keyboard)
 
 
+# route_text is registered before the state handlers, so the routes are
+# filled in here, once both button handlers exist.
+_ROUTES.update(
+    {
+        "новини": news_start,
+        "вибрати основне місто": choose_city_start,
+    }
+)
+
+
 @dp.message(NewsState.option)
 async def choose_news_option(message: types.Message, state: FSMContext):
     user_input = message.text.strip()
 
-    user_city = None
-    try:
-        async with AsyncSessionLocal() as session:
-            result = await session.execute(
-                select(Info.city).where(Info.user_id == message.from_user.id).limit(1)
-            )
-            user_city = result.scalar_one_or_none()
-    except Exception as e:
-        print(f"Помилка при читанні міста: {e}")
+    data = await state.get_data()
+    user_city = data.get("user_city")
 
     if user_input == "Пошук по містах":
         await state.set_state(CityState.news_city)
@@ -233,13 +389,7 @@ async def choose_news_option(message: types.Message, state: FSMContext):
     if not articles:
         await message.answer(f"Новин за '{query}' не знайдено 😕")
     else:
-        for article in articles:
-            try:
-                await message.answer(
-                    f"📰 <b>{article['title']}</b>\n{article['url']}", parse_mode="HTML"
-                )
-            except Exception as e:
-                print(f"Помилка при відправці новини: {e}")
+        await send_articles(message, articles)
 
     await state.clear()
     await message.answer("Операція завершена", reply_markup=main_kb)
@@ -256,25 +406,40 @@ async def search_news_by_city(message: types.Message, state: FSMContext):
     if not articles:
         await message.answer(f"Новин за '{city}' не знайдено 😕")
     else:
-        for article in articles:
-            try:
-                await message.answer(
-                    f"📰 <b>{article['title']}</b>\n{article['url']}", parse_mode="HTML"
-                )
-            except Exception as e:
-                print(f"Помилка при відправці новини: {e}")
+        await send_articles(message, articles)
 
     await state.clear()
     await message.answer("Операція завершена", reply_markup=main_kb)
 
 
 async def main():
+    global HTTP_SESSION
+
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(level=logging.WARNING, handlers=[QueueHandler(log_queue)])
+    log_listener = QueueListener(log_queue, logging.StreamHandler())
+    log_listener.start()
+
     await init_models()
+    HTTP_SESSION = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=100, limit_per_host=20, keepalive_timeout=75, ttl_dns_cache=300
+        ),
+        timeout=aiohttp.ClientTimeout(total=10),
+        raise_for_status=False,
+    )
+    refresh_task = asyncio.create_task(refresh_news()) if REDIS else None
     try:
         await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
+        if refresh_task:
+            refresh_task.cancel()
+            await asyncio.gather(refresh_task, return_exceptions=True)
+            await REDIS.aclose()
+        await HTTP_SESSION.close()
         await bot.session.close()
         await engine.dispose()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
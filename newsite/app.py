@@ -1,48 +1,106 @@
+import asyncio
+import logging
 import os
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
 
-import requests
+import httpx
+import orjson
+import redis.asyncio as aioredis
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from dotenv import load_dotenv
-from flask import Flask, flash, redirect, render_template, request, url_for
-from flask_login import (
-    LoginManager,
-    UserMixin,
+from quart import (
+    Quart,
+    flash,
+    get_flashed_messages,
+    redirect,
+    render_template,
+    request,
+    stream_template,
+    url_for,
+)
+from quart_auth import (
+    AuthUser,
+    QuartAuth,
+    Unauthorized,
     current_user,
     login_required,
     login_user,
     logout_user,
 )
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import Column, Integer, String, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from werkzeug.security import check_password_hash
+
+log = logging.getLogger(__name__)
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, logging.StreamHandler())
 
-app = Flask(__name__)
+app = Quart(__name__)
 load_dotenv()
 
 
 NEWSAPI_URL = "https://newsapi.org/v2/everything"
 API_KEY = os.getenv("API_KEY")
+NEWS_CACHE_TTL = 60
+NEWS_ERROR_TTL = 10
+REDIS_URL = os.getenv("REDIS_URL")
 DATABASE_URI = os.getenv("DATABASE_URI")
-app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URI
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "login"
+QuartAuth(app)
+
+
+def async_database_url(uri: str):
+    url = make_url(uri)
+    if url.drivername in ("postgres", "postgresql"):
+        url = url.set(drivername="postgresql+asyncpg")
+    return url
+
+
+engine = create_async_engine(
+    async_database_url(DATABASE_URI), echo=False, pool_pre_ping=True
+)
 
+AsyncSessionLocal = sessionmaker(
+    engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+    autoflush=False,
+    autocommit=False,
+)
+
+HTTP = httpx.AsyncClient(
+    timeout=10.0,
+    limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+)
+_news_cache = (0.0, [])
+_news_inflight: asyncio.Future | None = None
+REDIS = (
+    aioredis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    if REDIS_URL
+    else None
+)
 
-db = SQLAlchemy(app)
+ph = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
 
+Base = declarative_base()
 
-class User(db.Model, UserMixin):
+
+class User(Base):
     __tablename__ = "users"
 
-    id = db.Column(db.Integer, primary_key=True)
-    first_name = db.Column(db.String(100), nullable=False)
-    last_name = db.Column(db.String(100), nullable=False)
-    email = db.Column(db.String(150), nullable=False, unique=True)
-    password = db.Column(db.String(300), nullable=False)
+    id = Column(Integer, primary_key=True)
+    first_name = Column(String(100), nullable=False)
+    last_name = Column(String(100), nullable=False)
+    email = Column(String(150), nullable=False, unique=True)
+    password = Column(String(300), nullable=False)
 
 
-def fetch_news():
+async def request_news():
     params = {
         "q": "Україна",
         "language": "uk",
@@ -50,89 +108,181 @@ def fetch_news():
         "apiKey": API_KEY,
         "pageSize": 20,
     }
-    response = requests.get(NEWSAPI_URL, params=params)
-    data = response.json()
+    try:
+        response = await HTTP.get(NEWSAPI_URL, params=params)
+    except httpx.HTTPError as e:
+        log.warning("Помилка при запиті новин: %s", e)
+        return None
+    if response.status_code != 200:
+        return None
+    data = orjson.loads(response.content)
     return data.get("articles", [])
 
 
-@login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(user_id)
+async def fetch_news():
+    global _news_cache, _news_inflight
+
+    expires_at, articles = _news_cache
+    if time.monotonic() < expires_at:
+        return articles
+
+    if REDIS:
+        try:
+            raw = await REDIS.get("news:Україна")
+            if raw:
+                articles = orjson.loads(raw)
+                _news_cache = (time.monotonic() + NEWS_CACHE_TTL, articles)
+                return articles
+        except Exception as e:
+            log.warning("Помилка при читанні новин з Redis: %s", e)
+
+    if _news_inflight:
+        return await asyncio.shield(_news_inflight)
+
+    fut = asyncio.get_running_loop().create_future()
+    _news_inflight = fut
+    try:
+        fresh = await request_news()
+        if fresh is None:
+            _news_cache = (time.monotonic() + NEWS_ERROR_TTL, articles)
+        else:
+            articles = fresh
+            _news_cache = (time.monotonic() + NEWS_CACHE_TTL, articles)
+        fut.set_result(articles)
+        return articles
+    finally:
+        if not fut.done():
+            fut.set_result(articles)
+        _news_inflight = None
+
+
+def verify_password(password_hash: str, password: str):
+    if not password_hash.startswith("$argon2"):
+        return check_password_hash(password_hash, password)
+    try:
+        return ph.verify(password_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+@app.before_serving
+async def start_logging():
+    log.addHandler(QueueHandler(log_queue))
+    log.setLevel(logging.WARNING)
+    log_listener.start()
+
+
+@app.before_serving
+async def init_models():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+@app.after_serving
+async def close_connections():
+    await HTTP.aclose()
+    if REDIS:
+        await REDIS.aclose()
+    await engine.dispose()
+    log_listener.stop()
+
+
+@app.errorhandler(Unauthorized)
+async def redirect_to_login(*_):
+    return redirect(url_for("login"))
 
 
 @app.route("/")
-def home():
-    articles = fetch_news()
-    return render_template("index.html", articles=articles)
+async def home():
+    articles = await fetch_news()
+    # Pop the flashes before streaming starts, while the session can still be saved.
+    await get_flashed_messages(with_categories=True)
+    return await stream_template("index.html", articles=articles)
 
 
 @app.route("/register", methods=["GET", "POST"])
-def register():
+async def register():
     if request.method == "POST":
-        first_name = request.form.get("first_name")
-        last_name = request.form.get("last_name")
-        email = request.form.get("email")
-        password = request.form.get("password")
+        form = await request.form
+        first_name = form.get("first_name")
+        last_name = form.get("last_name")
+        email = form.get("email")
+        password = form.get("password")
 
         if not all([first_name, last_name, email, password]):
-            flash("Будь ласка, заповніть всі поля", "error")
+            await flash("Будь ласка, заповніть всі поля", "error")
             return redirect(url_for("register"))
 
-        existing_user = User.query.filter_by(email=email).first()
-        if existing_user:
-            flash("Email вже зареєстрований", "error")
-            return redirect(url_for("register"))
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(User).where(User.email == email))
+            if result.scalar_one_or_none():
+                await flash("Email вже зареєстрований", "error")
+                return redirect(url_for("register"))
 
-        new_user = User(
-            first_name=first_name,
-            last_name=last_name,
-            email=email,
-            password=generate_password_hash(password),
-        )
-        db.session.add(new_user)
-        db.session.commit()
-        flash("Реєстрація успішна! Тепер увійдіть", "success")
+            new_user = User(
+                first_name=first_name,
+                last_name=last_name,
+                email=email,
+                password=await asyncio.get_running_loop().run_in_executor(
+                    None, ph.hash, password
+                ),
+            )
+            session.add(new_user)
+            await session.commit()
+        await flash("Реєстрація успішна! Тепер увійдіть", "success")
         return redirect(url_for("login"))
-    return render_template("register.html")
+    return await render_template("register.html")
 
 
 @app.route("/login", methods=["GET", "POST"])
-def login():
+async def login():
     if request.method == "POST":
-        email = request.form.get("email")
-        password = request.form.get("password")
+        form = await request.form
+        email = form.get("email")
+        password = form.get("password")
 
         if not email or not password:
-            flash("Будь ласка, введіть email та пароль", "error")
+            await flash("Будь ласка, введіть email та пароль", "error")
             return redirect(url_for("login"))
 
-        user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.password, password):
-            login_user(user)
-            flash(f"Ласкаво просимо, {user.first_name}!", "success")
+        loop = asyncio.get_running_loop()
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(User).where(User.email == email))
+            user = result.scalar_one_or_none()
+            password_ok = user is not None and await loop.run_in_executor(
+                None, verify_password, user.password, password
+            )
+            if password_ok and (
+                not user.password.startswith("$argon2")
+                or ph.check_needs_rehash(user.password)
+            ):
+                user.password = await loop.run_in_executor(None, ph.hash, password)
+                await session.commit()
+        if password_ok:
+            login_user(AuthUser(str(user.id)))
+            await flash(f"Ласкаво просимо, {user.first_name}!", "success")
             return redirect(url_for("profile"))
 
-        flash("Неправильний email або пароль", "error")
+        await flash("Неправильний email або пароль", "error")
         return redirect(url_for("login"))
-    return render_template("login.html")
+    return await render_template("login.html")
 
 
 @app.route("/logout")
 @login_required
-def logout():
+async def logout():
     logout_user()
-    flash("Ви вийшли з акаунту", "info")
+    await flash("Ви вийшли з акаунту", "info")
     return redirect(url_for("home"))
 
 
 @app.route("/profile")
 @login_required
-def profile():
-    user = User.query.get(current_user.id)
-    return render_template("profile.html", user=user)
+async def profile():
+    async with AsyncSessionLocal() as session:
+        user = await session.get(User, int(current_user.auth_id))
+    return await render_template("profile.html", user=user)
 
 
 if __name__ == "__main__":
-    with app.app_context():
-        db.create_all()
     app.run(debug=True)